@@ -1,8 +1,17 @@
+import asyncio
+import copy
+import hashlib
 import os
 import json
-from typing import Dict, List
+import re
+import threading
+from typing import AsyncIterator, Dict, List, Optional
 
-from openai import OpenAI
+import httpx
+import orjson
+import pandas as pd
+from cachetools import LFUCache
+from openai import AsyncOpenAI, OpenAI
 
 # Project branding
 PROJECT_NAME = "SafeScroll"
@@ -10,32 +19,234 @@ PROJECT_SLUG = "safescroll"
 
 # OpenAI client (expects OPENAI_API_KEY env variable)
 # Keep the placeholder; user must set the env var in production.
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY", "YOUR_OPENAI_API_KEY_HERE"))
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "YOUR_OPENAI_API_KEY_HERE")
+
+# Shared HTTP settings for the sync and async clients: HTTP/2 and a connection
+# pool wide enough for the concurrent agent fan-out. httpx ignores client-level
+# limits/http2 when a transport is given, so they are set on the transport.
+HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+HTTP_RETRIES = 2
+
+_sync_http = httpx.Client(
+    transport=httpx.HTTPTransport(http2=True, limits=HTTP_LIMITS, retries=HTTP_RETRIES),
+    timeout=HTTP_TIMEOUT,
+)
+client = OpenAI(api_key=OPENAI_API_KEY, http_client=_sync_http)
+
+# Async clients are created lazily, one per thread/event loop (see _get_async_client)
+_async_local = threading.local()
 
 # Default model used for agents (change if you'd like)
 LLM_MODEL = "gpt-4o-mini"
+# Small, cheap model for the pre-screen that decides if a full audit is needed
+SCREEN_MODEL = "gpt-4.1-nano"
+
+# Safety classification has one right answer per input: sample greedily with a
+# fixed seed so repeated audits agree (and the response cache stays useful).
+DEFAULT_TEMPERATURE = 0.0
+DEFAULT_SEED = 94032
 
+# Ordered risk levels used across agents; content risk fields are per post
+RISK_LEVELS = ["none", "low", "medium", "high", "critical"]
+CONTENT_RISK_FIELDS = (
+    "bullying_risk",
+    "self_harm_risk",
+    "sexual_exploitation_risk",
+    "substance_abuse_risk",
+)
 
-def _run_json_agent(system_prompt: str, user_content: str, max_tokens: int = 400) -> Dict:
+
+def with_content_overall(content: Dict) -> Dict:
     """
-    Helper to call an LLM agent and parse JSON response.
+    Set content["overall"] to the per-field maximum over content["per_post"].
 
-    Returns an empty dict on parse failure.
+    The overall levels are aggregated here rather than asked of the LLM: it is
+    deterministic, always consistent with per_post, and saves output tokens.
+    Unknown or missing levels count as "none".
     """
-    try:
-        resp = client.chat.completions.create(
-            model=LLM_MODEL,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_content},
-            ],
-            response_format={"type": "json_object"},
-            max_tokens=max_tokens,
+    if not isinstance(content, dict) or "error" in content:
+        return content
+    per_post = pd.DataFrame(
+        [p for p in content.get("per_post") or [] if isinstance(p, dict)],
+        columns=list(CONTENT_RISK_FIELDS),
+    )
+    overall = {}
+    for field in CONTENT_RISK_FIELDS:
+        levels = pd.Categorical(
+            per_post[field].astype("string").str.lower(),
+            categories=RISK_LEVELS,
+            ordered=True,
         )
-    except Exception as e:
-        # Return a sensible error structure so callers can handle missing output
-        return {"error": f"LLM request failed: {e}"}
+        worst = levels.max() if len(levels) else None
+        overall[field] = worst if isinstance(worst, str) else "none"
+    merged = dict(content)
+    merged["overall"] = overall
+    return merged
+
+
+# Cheap deterministic pre-filter for content and interaction scoring: posts and
+# DMs that match none of these terms (risk lexicons, explicit age mentions,
+# links) are treated as innocuous and not sent to the content/interaction
+# agents. The pre-screen and underage assessment still see every post, so
+# everyday school/exam talk is deliberately not matched here.
+_SAFETY_TERMS = [
+    # bullying & harassment
+    r"ugly", r"loser", r"stupid", r"idiot", r"nobody likes", r"hate (?:you|u)\b", r"\bkys\b",
+    r"kill (?:yo)?urself", r"just leave",
+    # self-harm & mental health
+    r"suicid", r"self[- ]?harm", r"cut(?:ting)? myself", r"hurt myself", r"disappear",
+    r"nothing matters", r"not eaten", r"starv", r"worthless", r"\bwant to die\b",
+    # grooming & secrecy
+    r"secret", r"don['’]?t tell", r"trust me", r"\balone\b", r"\bmeet\b", r"\bpics?\b",
+    r"photos?", r"\bolder\b", r"parents",
+    # substance use
+    r"drunk", r"pills?", r"smok", r"\bweed\b", r"vap(?:e|ing)", r"drugs?", r"alcohol",
+    r"\bbeer\b", r"vodka", r"\bhigh\b",
+    # explicit age mentions
+    r"age_\d+", r"\byears? old\b", r"\bminor\b", r"underage",
+    # links
+    r"https?://", r"www\.",
+]
+SAFETY_RE = re.compile("|".join(_SAFETY_TERMS), re.IGNORECASE)
+
+
+def merge_prefiltered_posts(content: Dict, skipped_posts: List[Dict]) -> Dict:
+    """
+    Add "none"-risk per_post entries for posts the SAFETY_RE pre-filter kept
+    away from the LLM, so per_post still covers every post.
+    """
+    if not skipped_posts or "error" in content:
+        return content
+    skipped = [
+        {
+            "post_id": p.get("post_id"),
+            "text": p.get("text"),
+            **{field: "none" for field in CONTENT_RISK_FIELDS},
+            "notes": "Skipped by keyword pre-filter.",
+        }
+        for p in skipped_posts
+    ]
+    merged = dict(content)
+    merged["per_post"] = list(content.get("per_post") or []) + skipped
+    return with_content_overall(merged)
+
+
+# In-process cache of parsed agent responses. Streamlit reruns the script on
+# every widget interaction, so identical audits would otherwise pay for the
+# same LLM calls again. Shared by all sessions, hence the lock. Only
+# `_run_json_agent[_async]` use it; streamed agent calls bypass it.
+_response_cache = LFUCache(maxsize=512)
+_cache_lock = threading.Lock()
+CACHE_STATS = {"hits": 0, "misses": 0}
+
+
+def _get_async_client() -> AsyncOpenAI:
+    """
+    Return an AsyncOpenAI client bound to the current event loop.
+
+    Pooled connections cannot be carried across event loops, so the client is
+    rebuilt whenever the running loop changes (e.g. one asyncio.run() per call).
+    Kept per-thread since each loop runs in its own thread.
+    """
+    loop = asyncio.get_running_loop()
+    if getattr(_async_local, "loop", None) is not loop:
+        async_http = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(
+                http2=True, limits=HTTP_LIMITS, retries=HTTP_RETRIES
+            ),
+            timeout=HTTP_TIMEOUT,
+        )
+        _async_local.client = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=async_http)
+        _async_local.loop = loop
+    return _async_local.client
+
+
+def _dumps(obj) -> str:
+    # orjson keeps non-ASCII text as-is (like ensure_ascii=False) and is much
+    # faster than json.dumps on large post/interaction lists
+    return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode("utf-8")
+
+
+# Strict and fast; the lenient recovery in _parse_json_content stays on stdlib json
+_loads = orjson.loads
+
+
+# The only profile fields the agent prompts use; created_at etc. are dropped.
+PROFILE_FIELDS = ("user_id", "age", "account_type")
+
+
+def _slim_profile(user_profile: Dict) -> Dict:
+    return {k: user_profile[k] for k in PROFILE_FIELDS if k in user_profile}
+
+
+def _cache_key(request: Dict) -> str:
+    # Whitespace is normalized so cosmetic prompt edits don't miss the cache
+    normalized = "\x1f".join(" ".join(m["content"].split()) for m in request["messages"])
+    params = (request["model"], request["max_tokens"], request["temperature"], request["seed"])
+    raw = "\x1f".join(str(p) for p in params) + "\x1f" + normalized
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _cache_get(key: str) -> Optional[Dict]:
+    with _cache_lock:
+        hit = _response_cache.get(key)
+        CACHE_STATS["hits" if hit is not None else "misses"] += 1
+    # Callers may mutate results, so never hand out the cached object itself
+    return copy.deepcopy(hit) if hit is not None else None
+
+
+def _cache_put(key: str, result: Dict) -> None:
+    # Failures are not cached so the next rerun retries them
+    if "error" in result:
+        return
+    with _cache_lock:
+        _response_cache[key] = copy.deepcopy(result)
+
+
+# Follow-up turn used for the single retry after an unparseable reply
+JSON_REPROMPT = "Your previous reply was not valid JSON. Return only valid JSON."
+
+# Models sometimes wrap JSON in markdown fences despite JSON mode
+_JSON_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+_json_decoder = json.JSONDecoder()
+
+
+def _completion_kwargs(
+    system_prompt: str,
+    user_content: str,
+    max_tokens: int,
+    model: str = LLM_MODEL,
+    temperature: float = DEFAULT_TEMPERATURE,
+    seed: int = DEFAULT_SEED,
+) -> Dict:
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_content},
+        ],
+        "response_format": {"type": "json_object"},
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "seed": seed,
+    }
+
+
+def _with_json_reprompt(request: Dict, failed: Dict) -> Dict:
+    """
+    Copy of a chat request continued with the unparseable reply (failed["raw"])
+    as the assistant turn and the JSON_REPROMPT follow-up after it.
+    """
+    retry = dict(request)
+    retry["messages"] = request["messages"] + [
+        {"role": "assistant", "content": failed.get("raw") or ""},
+        {"role": "user", "content": JSON_REPROMPT},
+    ]
+    return retry
+
 
+def _parse_json_response(resp) -> Dict:
     # Extract content in a defensive way
     try:
         content = resp.choices[0].message.content
@@ -43,40 +254,160 @@ def _run_json_agent(system_prompt: str, user_content: str, max_tokens: int = 400
         # Unexpected response shape
         return {"error": "unexpected LLM response format"}
 
+    return _parse_json_content(content)
+
+
+def _parse_json_content(content: str) -> Dict:
     # Try to parse JSON strictly, fall back to heuristic extraction
     try:
-        return json.loads(content)
+        parsed = _loads(content)
+        if isinstance(parsed, dict):
+            return parsed
     except Exception:
-        # attempt to recover JSON substring
+        pass
+
+    # attempt to recover a JSON object: unwrap a code fence if present, then
+    # take the first "{" that decodes as a complete (balanced) object
+    text = content or ""
+    fence = _JSON_FENCE_RE.search(text)
+    if fence:
+        text = fence.group(1)
+    idx = text.find("{")
+    while idx != -1:
+        try:
+            parsed, _ = _json_decoder.raw_decode(text, idx)
+            if isinstance(parsed, dict):
+                return parsed
+        except ValueError:
+            pass
+        idx = text.find("{", idx + 1)
+
+    # best-effort: return raw content for debugging
+    return {"error": "failed to parse JSON", "raw": content}
+
+
+def _should_retry_json(resp, result: Dict) -> bool:
+    """
+    Retry once when the reply was unparseable, unless it was cut off by
+    max_tokens: the same budget would truncate again (content scoring handles
+    that by splitting the batch instead).
+    """
+    if "raw" not in result:
+        return False
+    try:
+        return resp.choices[0].finish_reason != "length"
+    except Exception:
+        return True
+
+
+def _run_json_agent(
+    system_prompt: str,
+    user_content: str,
+    max_tokens: int = 400,
+    model: str = LLM_MODEL,
+    temperature: float = DEFAULT_TEMPERATURE,
+    seed: int = DEFAULT_SEED,
+) -> Dict:
+    """
+    Helper to call an LLM agent and parse JSON response.
+
+    Returns a dict with an "error" key on request or parse failure.
+    Successful results are served from the response cache when inputs repeat.
+    """
+    request = _completion_kwargs(system_prompt, user_content, max_tokens, model, temperature, seed)
+    key = _cache_key(request)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    try:
+        resp = client.chat.completions.create(**request)
+    except Exception as e:
+        # Return a sensible error structure so callers can handle missing output
+        return {"error": f"LLM request failed: {e}"}
+
+    result = _parse_json_response(resp)
+    if _should_retry_json(resp, result):
         try:
-            idx = content.rfind("{")
-            if idx != -1:
-                return json.loads(content[idx:])
+            resp = client.chat.completions.create(**_with_json_reprompt(request, result))
+            result = _parse_json_response(resp)
         except Exception:
-            # best-effort: return raw content for debugging
-            return {"error": "failed to parse JSON", "raw": content}
+            # keep the original parse failure
+            pass
+    _cache_put(key, result)
+    return result
 
 
-def underage_risk_agent(user_profile: Dict, posts: List[Dict]) -> Dict:
+async def _run_json_agent_async(
+    system_prompt: str,
+    user_content: str,
+    max_tokens: int = 400,
+    model: str = LLM_MODEL,
+    temperature: float = DEFAULT_TEMPERATURE,
+    seed: int = DEFAULT_SEED,
+) -> Dict:
     """
-    Agent: Estimate underage risk based on declared age and content style.
+    Async variant of `_run_json_agent`, so independent agents can be awaited
+    concurrently with asyncio.gather.
+    """
+    request = _completion_kwargs(system_prompt, user_content, max_tokens, model, temperature, seed)
+    key = _cache_key(request)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
 
-    Input:
-      - user_profile: {"user_id": "...", "age": int, ...}
-      - posts: list of {"post_id": "...", "text": "...", ...}
+    try:
+        resp = await _get_async_client().chat.completions.create(**request)
+    except Exception as e:
+        return {"error": f"LLM request failed: {e}"}
 
-    Output JSON structure:
-    {
-      "is_minor_suspected": true,
-      "underage_misrepresentation_risk": 0,
-      "reason": ""
-    }
+    result = _parse_json_response(resp)
+    if _should_retry_json(resp, result):
+        try:
+            resp = await _get_async_client().chat.completions.create(
+                **_with_json_reprompt(request, result)
+            )
+            result = _parse_json_response(resp)
+        except Exception:
+            pass
+    _cache_put(key, result)
+    return result
+
+
+def _stream_kwargs(
+    system_prompt: str, user_content: str, max_tokens: int, json_mode: bool = False
+) -> Dict:
+    kwargs = _completion_kwargs(system_prompt, user_content, max_tokens)
+    if not json_mode:
+        del kwargs["response_format"]
+    kwargs["stream"] = True
+    return kwargs
+
+
+async def _run_stream_agent_async(
+    system_prompt: str, user_content: str, max_tokens: int = 400, json_mode: bool = False
+) -> AsyncIterator[str]:
+    """
+    Helper to call an LLM agent with stream=True and yield raw text deltas.
+
+    JSON response_format is only requested with json_mode (free-text output
+    otherwise). Streams bypass the response cache. Request failures are raised;
+    callers decide how to surface them in the stream.
     """
+    stream = await _get_async_client().chat.completions.create(
+        **_stream_kwargs(system_prompt, user_content, max_tokens, json_mode)
+    )
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+def _underage_request(user_profile: Dict, posts: List[Dict]) -> Dict:
     system_prompt = f"""
 You are an Underage Risk Detection Agent for {PROJECT_NAME}.
 
 You receive:
-- A user profile (age, account_type, created_at)
+- A user profile (user_id, age, account_type)
 - A sample of their posts
 
 Task:
@@ -92,41 +423,40 @@ Output strict JSON:
   "reason": ""
 }}
 """
-    user_str = json.dumps(user_profile, ensure_ascii=False)
-    posts_str = json.dumps(posts, ensure_ascii=False)
+    user_str = _dumps(_slim_profile(user_profile))
+    posts_str = _dumps(posts)
     user_content = f"USER_PROFILE:\n{user_str}\n\nSAMPLE_POSTS:\n{posts_str}"
-    return _run_json_agent(system_prompt, user_content)
+    return {
+        "system_prompt": system_prompt,
+        "user_content": user_content,
+        "max_tokens": 180,
+    }
 
 
-def content_risk_agent(posts: List[Dict]) -> Dict:
+def underage_risk_agent(user_profile: Dict, posts: List[Dict]) -> Dict:
     """
-    Agent: Analyze content for bullying, self-harm, sexual exploitation, substance abuse.
+    Agent: Estimate underage risk based on declared age and content style.
 
     Input:
+      - user_profile: {"user_id": "...", "age": int, ...}
       - posts: list of {"post_id": "...", "text": "...", ...}
 
     Output JSON structure:
     {
-      "per_post": [
-        {
-          "post_id": "",
-          "text": "",
-          "bullying_risk": "none",
-          "self_harm_risk": "none",
-          "sexual_exploitation_risk": "none",
-          "substance_abuse_risk": "none",
-          "notes": ""
-        }
-      ],
-      "overall": {
-        "bullying_risk": "none",
-        "self_harm_risk": "none",
-        "sexual_exploitation_risk": "none",
-        "substance_abuse_risk": "none",
-        "summary": ""
-      }
+      "is_minor_suspected": true,
+      "underage_misrepresentation_risk": 0,
+      "reason": ""
     }
     """
+    return _run_json_agent(**_underage_request(user_profile, posts))
+
+
+async def underage_risk_agent_async(user_profile: Dict, posts: List[Dict]) -> Dict:
+    """Async variant of `underage_risk_agent`."""
+    return await _run_json_agent_async(**_underage_request(user_profile, posts))
+
+
+def _content_request(posts: List[Dict]) -> Dict:
     system_prompt = f"""
 You are a Content Safety Agent working for {PROJECT_NAME}.
 
@@ -136,9 +466,10 @@ You receive a list of posts from one user. For each post, you should detect:
 - sexual_exploitation_or_grooming
 - substance_abuse
 
-Then aggregate into overall risk levels.
+Risk levels should be "none", "low", "medium", or "high".
 
-Overall risk levels should be "none", "low", "medium", or "high".
+Return `per_post` as an array of exactly N={len(posts)} objects, one per input
+post, in the same order as the input.
 
 Output this strict JSON:
 
@@ -153,41 +484,102 @@ Output this strict JSON:
       "substance_abuse_risk": "none",
       "notes": ""
     }}
-  ],
-  "overall": {{
-    "bullying_risk": "none",
-    "self_harm_risk": "none",
-    "sexual_exploitation_risk": "none",
-    "substance_abuse_risk": "none",
-    "summary": ""
-  }}
+  ]
 }}
 """
-    posts_str = json.dumps(posts, ensure_ascii=False)
-    return _run_json_agent(system_prompt, posts_str, max_tokens=1000)
+    # Only the fields the prompt uses; output budget grows with the batch
+    slim_posts = [{"post_id": p.get("post_id"), "text": p.get("text")} for p in posts]
+    posts_str = _dumps(slim_posts)
+    return {
+        "system_prompt": system_prompt,
+        "user_content": posts_str,
+        "max_tokens": min(4096, 40 + 80 * len(posts)),
+    }
 
 
-def interaction_risk_agent(user_profile: Dict, interactions: List[Dict]) -> Dict:
+def _content_needs_split(result: Dict, posts: List[Dict]) -> bool:
     """
-    Agent: Analyze direct messages / interactions for grooming-like patterns and power imbalance.
+    True if a content result is unusable for this batch and worth retrying as
+    two halves: the per_post array doesn't line up 1:1 with the input, or the
+    JSON was cut off. Request failures are not retried this way.
+    """
+    if len(posts) <= 1:
+        return False
+    if "error" in result:
+        return "raw" in result
+    per_post = result.get("per_post")
+    return not isinstance(per_post, list) or len(per_post) != len(posts)
+
+
+def _merge_content_results(left: Dict, right: Dict) -> Dict:
+    """
+    Combine content results for two halves of a batch. If either half failed
+    the merge is an error too (keeping whatever per_post entries were scored),
+    so a partially scored batch is never treated as a clean result.
+    """
+    per_post = [entry for part in (left, right) for entry in part.get("per_post") or []]
+    errors = [part["error"] for part in (left, right) if "error" in part]
+    if errors:
+        return {"error": "; ".join(errors), "per_post": per_post}
+    return with_content_overall({"per_post": per_post})
+
+
+def content_risk_agent(posts: List[Dict]) -> Dict:
+    """
+    Agent: Analyze content for bullying, self-harm, sexual exploitation, substance abuse.
 
     Input:
-      - user_profile: profile for the audited user
-      - interactions: list of {"interaction_id","from_user","to_user","text","from_age","to_age",...}
+      - posts: list of {"post_id": "...", "text": "...", ...}
 
     Output JSON structure:
     {
-      "grooming_risk": "none",
-      "evidence": [
+      "per_post": [
         {
-          "interaction_id": "",
-          "text_snippet": "",
-          "comment": ""
+          "post_id": "",
+          "text": "",
+          "bullying_risk": "none",
+          "self_harm_risk": "none",
+          "sexual_exploitation_risk": "none",
+          "substance_abuse_risk": "none",
+          "notes": ""
         }
       ],
-      "summary": ""
+      "overall": {
+        "bullying_risk": "none",
+        "self_harm_risk": "none",
+        "sexual_exploitation_risk": "none",
+        "substance_abuse_risk": "none"
+      }
     }
+
+    "overall" is aggregated from per_post by `with_content_overall`, not by
+    the model.
+
+    If the model returns the wrong number of per_post entries (typically output
+    truncation on large users), the posts are split in half and each half is
+    scored separately, recursively.
     """
+    result = _run_json_agent(**_content_request(posts))
+    if not _content_needs_split(result, posts):
+        return with_content_overall(result)
+    mid = len(posts) // 2
+    return _merge_content_results(content_risk_agent(posts[:mid]), content_risk_agent(posts[mid:]))
+
+
+async def content_risk_agent_async(posts: List[Dict]) -> Dict:
+    """Async variant of `content_risk_agent`; split halves are scored concurrently."""
+    result = await _run_json_agent_async(**_content_request(posts))
+    if not _content_needs_split(result, posts):
+        return with_content_overall(result)
+    mid = len(posts) // 2
+    left, right = await asyncio.gather(
+        content_risk_agent_async(posts[:mid]),
+        content_risk_agent_async(posts[mid:]),
+    )
+    return _merge_content_results(left, right)
+
+
+def _interaction_request(user_profile: Dict, interactions: List[Dict]) -> Dict:
     system_prompt = f"""
 You are an Interaction Risk Agent for {PROJECT_NAME}.
 
@@ -216,31 +608,289 @@ Output strict JSON:
   "summary": ""
 }}
 """
-    payload = {"user_profile": user_profile, "interactions": interactions}
-    return _run_json_agent(system_prompt, json.dumps(payload, ensure_ascii=False), max_tokens=800)
+    payload = {"user_profile": _slim_profile(user_profile), "interactions": interactions}
+    return {
+        "system_prompt": system_prompt,
+        "user_content": _dumps(payload),
+        "max_tokens": 400,
+    }
 
 
-def policy_violation_agent(policy_text: str, aggregated_findings: Dict) -> Dict:
+def interaction_risk_agent(user_profile: Dict, interactions: List[Dict]) -> Dict:
     """
-    Agent: Map earlier findings to company policy violations.
+    Agent: Analyze direct messages / interactions for grooming-like patterns and power imbalance.
 
     Input:
-      - policy_text: raw company safety policies (string)
-      - aggregated_findings: dict combining outputs from other agents
+      - user_profile: profile for the audited user
+      - interactions: list of {"interaction_id","from_user","to_user","text","from_age","to_age",...}
 
     Output JSON structure:
     {
-      "violated_sections": [],
-      "overall_severity": "low",
-      "recommended_action": "",
-      "explanation": ""
+      "grooming_risk": "none",
+      "evidence": [
+        {
+          "interaction_id": "",
+          "text_snippet": "",
+          "comment": ""
+        }
+      ],
+      "summary": ""
     }
     """
+    return _run_json_agent(**_interaction_request(user_profile, interactions))
+
+
+async def interaction_risk_agent_async(user_profile: Dict, interactions: List[Dict]) -> Dict:
+    """Async variant of `interaction_risk_agent`."""
+    return await _run_json_agent_async(**_interaction_request(user_profile, interactions))
+
+
+def _screen_request(user_profile: Dict, posts: List[Dict], interactions: List[Dict]) -> Dict:
+    system_prompt = f"""
+You are a fast pre-screen for {PROJECT_NAME} safety audits.
+
+Given one user's profile, posts and direct messages, decide if the user is
+trivially clean: no bullying, self-harm, sexual content, grooming, secrecy
+pressure, substance use, or suspicious adult-to-minor contact.
+If in any doubt, set needs_full_audit to true.
+
+Output strict JSON:
+{{"needs_full_audit": true, "reason": ""}}
+"""
+    payload = {
+        "user_profile": _slim_profile(user_profile),
+        "posts": posts,
+        "interactions": interactions,
+    }
+    return {
+        "system_prompt": system_prompt,
+        "user_content": _dumps(payload),
+        "max_tokens": 80,
+        "model": SCREEN_MODEL,
+    }
+
+
+def _screen_verdict(result: Dict) -> Dict:
+    # Anything but an explicit False (errors included) means run the full audit
+    if result.get("needs_full_audit") is False:
+        return {"needs_full_audit": False, "reason": str(result.get("reason", ""))}
+    return {"needs_full_audit": True, "reason": str(result.get("reason") or result.get("error", ""))}
+
+
+def triage_screen(user_profile: Dict, posts: List[Dict], interactions: List[Dict]) -> Dict:
+    """
+    Agent: Cheap pre-screen run before the full pipeline.
+
+    Output structure:
+    {
+      "needs_full_audit": true,
+      "reason": ""
+    }
+    """
+    return _screen_verdict(_run_json_agent(**_screen_request(user_profile, posts, interactions)))
+
+
+async def triage_screen_async(user_profile: Dict, posts: List[Dict], interactions: List[Dict]) -> Dict:
+    """Async variant of `triage_screen`."""
+    result = await _run_json_agent_async(**_screen_request(user_profile, posts, interactions))
+    return _screen_verdict(result)
+
+
+def clean_audit_results(user_profile: Dict, posts: List[Dict], reason: str) -> Dict:
+    """
+    Build no-risk results for a user the pre-screen cleared, without any LLM
+    calls. Keys and shapes match what the full pipeline produces.
+    """
+    note = f"Cleared by pre-screen: {reason}" if reason else "Cleared by pre-screen."
+    age = user_profile.get("age")
+    per_post = [
+        {
+            "post_id": p.get("post_id"),
+            "text": p.get("text"),
+            **{field: "none" for field in CONTENT_RISK_FIELDS},
+            "notes": "",
+        }
+        for p in posts
+    ]
+    return {
+        "underage": {
+            "is_minor_suspected": isinstance(age, (int, float)) and age < 18,
+            "underage_misrepresentation_risk": 0,
+            "reason": note,
+        },
+        "content": with_content_overall({"per_post": per_post}),
+        "interaction": {"grooming_risk": "none", "evidence": [], "summary": note},
+        "policy": {
+            "violated_sections": [],
+            "overall_severity": "low",
+            "recommended_action": "monitor",
+            "explanation": note,
+        },
+        "report": {
+            "risk_title": f"{PROJECT_NAME} Safety Report",
+            "overall_risk_score": 0,
+            "risk_summary": "No risks detected.",
+            "markdown_report": f"### Summary\nNo safety concerns detected.\n\n{note}",
+        },
+    }
+
+
+# Rough input size (in tokens, ~4 chars each) above which the fused triage call
+# is skipped in favor of the three single-purpose agents.
+TRIAGE_INPUT_TOKEN_BUDGET = 6000
+
+
+def _triage_request(
+    user_profile: Dict,
+    posts: List[Dict],
+    interactions: List[Dict],
+    content_post_ids: Optional[List] = None,
+) -> Dict:
+    system_prompt = f"""
+You are a Safety Triage Agent for {PROJECT_NAME}.
+
+You receive ONE user's profile, a sample of their posts, and their direct
+message interactions with others (including age information).
+
+Perform three independent assessments:
+
+A. UNDERAGE RISK
+1. Estimate if the user appears UNDER 18 or ADULT based on content style and declared age.
+2. Output a risk score for "underage_misrepresentation" from 0 to 100.
+3. Provide reasoning.
+
+B. CONTENT RISK
+For each post whose post_id is listed in "content_post_ids", detect:
+- bullying
+- self_harm
+- sexual_exploitation_or_grooming
+- substance_abuse
+Risk levels are "none", "low", "medium", or "high".
+Return `per_post` with exactly one object per listed post_id, in that order.
+Use all posts for the underage assessment.
+
+C. INTERACTION RISK
+1. Detect if there are signs of grooming or sexual exploitation risk.
+2. Consider age differences (older messaging younger).
+3. Output a "grooming_risk" level: "none", "low", "medium", "high", "critical".
+4. Provide key evidence snippets.
+
+Output strict JSON:
+
+{{
+  "underage": {{
+    "is_minor_suspected": true,
+    "underage_misrepresentation_risk": 0,
+    "reason": ""
+  }},
+  "content": {{
+    "per_post": [
+      {{
+        "post_id": "",
+        "text": "",
+        "bullying_risk": "none",
+        "self_harm_risk": "none",
+        "sexual_exploitation_risk": "none",
+        "substance_abuse_risk": "none",
+        "notes": ""
+      }}
+    ]
+  }},
+  "interaction": {{
+    "grooming_risk": "none",
+    "evidence": [
+      {{
+        "interaction_id": "",
+        "text_snippet": "",
+        "comment": ""
+      }}
+    ],
+    "summary": ""
+  }}
+}}
+"""
+    if content_post_ids is None:
+        content_post_ids = [p.get("post_id") for p in posts]
+    payload = {
+        "user_profile": _slim_profile(user_profile),
+        "posts": posts,
+        "content_post_ids": content_post_ids,
+        "interactions": interactions,
+    }
+    return {
+        "system_prompt": system_prompt,
+        "user_content": _dumps(payload),
+        "max_tokens": min(4096, 180 + 40 + 80 * len(content_post_ids) + 400),
+    }
+
+
+def fits_triage_budget(
+    user_profile: Dict,
+    posts: List[Dict],
+    interactions: List[Dict],
+    content_post_ids: Optional[List] = None,
+) -> bool:
+    """Return True if the fused triage input is small enough for one call."""
+    request = _triage_request(user_profile, posts, interactions, content_post_ids)
+    approx_tokens = (len(request["system_prompt"]) + len(request["user_content"])) // 4
+    return approx_tokens <= TRIAGE_INPUT_TOKEN_BUDGET
+
+
+def triage_agent(
+    user_profile: Dict,
+    posts: List[Dict],
+    interactions: List[Dict],
+    content_post_ids: Optional[List] = None,
+) -> Dict:
+    """
+    Agent: Run the underage, content and interaction assessments in one call.
+
+    The three single agents see largely the same user data; fusing them sends
+    it once. The single agents remain as the fallback for inputs over
+    TRIAGE_INPUT_TOKEN_BUDGET or when this call fails.
+
+    The underage assessment uses all posts; content scores only the posts in
+    content_post_ids (default: all of them), e.g. those a pre-filter flagged.
+
+    Output JSON structure:
+    {
+      "underage": {...},     # as underage_risk_agent
+      "content": {...},      # as content_risk_agent
+      "interaction": {...}   # as interaction_risk_agent
+    }
+    """
+    request = _triage_request(user_profile, posts, interactions, content_post_ids)
+    return _with_triage_overall(_run_json_agent(**request))
+
+
+async def triage_agent_async(
+    user_profile: Dict,
+    posts: List[Dict],
+    interactions: List[Dict],
+    content_post_ids: Optional[List] = None,
+) -> Dict:
+    """Async variant of `triage_agent`."""
+    request = _triage_request(user_profile, posts, interactions, content_post_ids)
+    result = await _run_json_agent_async(**request)
+    return _with_triage_overall(result)
+
+
+def _with_triage_overall(result: Dict) -> Dict:
+    if isinstance(result.get("content"), dict):
+        result = dict(result)
+        result["content"] = with_content_overall(result["content"])
+    return result
+
+
+def _policy_request(policy_text: str, aggregated_findings: Dict) -> Dict:
+    # The policies go at the end of the system prompt, not in the user message,
+    # so the whole system message is a byte-identical prefix across users and
+    # can hit OpenAI's automatic prompt cache (prefixes of 1024+ tokens).
     system_prompt = f"""
 You are a Policy Violation Agent for {PROJECT_NAME}.
 
 You receive:
-- Company safety policies text.
+- Company safety policies text (below, under POLICIES).
 - Aggregated findings from other safety agents about a single user.
 
 Task:
@@ -263,30 +913,112 @@ Output strict JSON:
   "explanation": ""
 }}
 """
-    payload = {"policies": policy_text, "findings": aggregated_findings}
-    return _run_json_agent(system_prompt, json.dumps(payload, ensure_ascii=False), max_tokens=600)
+    system_prompt += "\n\nPOLICIES:\n" + policy_text
+    payload = {"findings": aggregated_findings}
+    return {
+        "system_prompt": system_prompt,
+        "user_content": _dumps(payload),
+        "max_tokens": 300,
+    }
 
 
-def report_generator_agent(
-    user_profile: Dict,
-    underage: Dict,
-    content: Dict,
-    interactions: Dict,
-    policy_result: Dict,
-) -> Dict:
+def policy_violation_agent(policy_text: str, aggregated_findings: Dict) -> Dict:
     """
-    Agent: Generate a human-readable safety report (markdown-style).
+    Agent: Map earlier findings to company policy violations.
 
     Input:
-      - structured JSON from the other agents
+      - policy_text: raw company safety policies (string); pass the same string
+        for every user so the prompt prefix stays cacheable
+      - aggregated_findings: dict combining outputs from other agents
+
     Output JSON structure:
     {
-      "risk_title": "",
-      "overall_risk_score": 0,
-      "risk_summary": "",
-      "markdown_report": ""
+      "violated_sections": [],
+      "overall_severity": "low",
+      "recommended_action": "",
+      "explanation": ""
     }
     """
+    return _run_json_agent(**_policy_request(policy_text, aggregated_findings))
+
+
+async def policy_violation_agent_stream_async(
+    policy_text: str, aggregated_findings: Dict
+) -> AsyncIterator[str]:
+    """
+    Agent: `policy_violation_agent` as a stream of raw JSON text.
+
+    Lets the caller act on `preliminary_policy` before the explanation has
+    finished decoding. Parse the assembled text with `parse_streamed_policy`.
+    """
+    request = _policy_request(policy_text, aggregated_findings)
+    async for chunk in _run_stream_agent_async(**request, json_mode=True):
+        yield chunk
+
+
+_POLICY_STRING_FIELD_RE = {
+    field: re.compile(rf'"{field}"\s*:\s*"([^"]*)"')
+    for field in ("overall_severity", "recommended_action")
+}
+_POLICY_SECTIONS_RE = re.compile(r'"violated_sections"\s*:\s*(\[[^\]]*\])')
+
+
+def preliminary_policy(partial_json: str) -> Optional[Dict]:
+    """
+    Decision fields from a partially streamed policy result, or None until
+    "overall_severity", "recommended_action" and "violated_sections" have all
+    closed, so a report started from it sees the complete decision.
+    """
+    decision = {}
+    for field, pattern in _POLICY_STRING_FIELD_RE.items():
+        match = pattern.search(partial_json)
+        if not match:
+            return None
+        decision[field] = match.group(1)
+    sections = _POLICY_SECTIONS_RE.search(partial_json)
+    if not sections:
+        return None
+    try:
+        decision["violated_sections"] = _loads(sections.group(1))
+    except Exception:
+        return None
+    return decision
+
+
+def parse_streamed_policy(streamed_text: str) -> Dict:
+    """Parse a fully streamed policy result into the `policy_violation_agent` dict."""
+    if not streamed_text.strip():
+        return {"error": "empty policy stream"}
+    return _parse_json_content(streamed_text)
+
+
+def policy_diverges(assumed: Dict, actual: Dict) -> bool:
+    """
+    True if two policy results disagree on severity, recommended action or
+    the violated sections (compared as a case-insensitive set).
+    """
+    def decision(policy: Dict):
+        sections = policy.get("violated_sections") or []
+        if not isinstance(sections, list):
+            sections = [sections]
+        return (
+            *(
+                str(policy.get(field, "")).strip().lower()
+                for field in ("overall_severity", "recommended_action")
+            ),
+            frozenset(str(section).strip().lower() for section in sections),
+        )
+
+    return decision(assumed) != decision(actual)
+
+
+def _report_request(
+    user_profile: Dict,
+    underage: Dict,
+    content: Dict,
+    interactions: Dict,
+    policy_result: Dict,
+) -> Dict:
     system_prompt = f"""
 You are a Safety Report Generator Agent for {PROJECT_NAME}.
 
@@ -314,10 +1046,125 @@ Output strict JSON:
 }}
 """
     payload = {
-        "user_profile": user_profile,
+        "user_profile": _slim_profile(user_profile),
         "underage": underage,
         "content": content,
         "interactions": interactions,
         "policy_result": policy_result,
     }
-    return _run_json_agent(system_prompt, json.dumps(payload, ensure_ascii=False), max_tokens=900)
+    return {
+        "system_prompt": system_prompt,
+        "user_content": _dumps(payload),
+        "max_tokens": 700,
+    }
+
+
+def report_generator_agent(
+    user_profile: Dict,
+    underage: Dict,
+    content: Dict,
+    interactions: Dict,
+    policy_result: Dict,
+) -> Dict:
+    """
+    Agent: Generate a human-readable safety report (markdown-style).
+
+    Input:
+      - structured JSON from the other agents
+    Output JSON structure:
+    {
+      "risk_title": "",
+      "overall_risk_score": 0,
+      "risk_summary": "",
+      "markdown_report": ""
+    }
+    """
+    return _run_json_agent(
+        **_report_request(user_profile, underage, content, interactions, policy_result)
+    )
+
+
+# Streamed reports put the markdown body first so it can be shown while it is
+# generated; the structured header fields follow this marker as one JSON object.
+REPORT_META_DELIMITER = "<<<REPORT_META>>>"
+
+
+def _report_stream_request(
+    user_profile: Dict,
+    underage: Dict,
+    content: Dict,
+    interactions: Dict,
+    policy_result: Dict,
+) -> Dict:
+    request = _report_request(user_profile, underage, content, interactions, policy_result)
+    system_prompt = f"""
+You are a Safety Report Generator Agent for {PROJECT_NAME}.
+
+You receive structured JSON from several safety agents for ONE user:
+- underage risk
+- content risk
+- interaction/grooming risk
+- policy violation summary
+
+Task:
+1. Produce a clear, human-readable report in markdown.
+2. Include:
+   - short user summary
+   - key risks
+   - evidence examples
+   - final recommended action
+
+Output format (no code fences):
+- First, the markdown report itself.
+- Then a line containing only {REPORT_META_DELIMITER}
+- Then one line of strict JSON:
+{{"risk_title": "", "overall_risk_score": 0, "risk_summary": ""}}
+"""
+    return {**request, "system_prompt": system_prompt}
+
+
+def _report_stream_error(e: Exception) -> str:
+    meta = {"error": f"LLM request failed: {e}"}
+    return f"\n{REPORT_META_DELIMITER}\n{_dumps(meta)}"
+
+
+async def report_generator_agent_stream_async(
+    user_profile: Dict,
+    underage: Dict,
+    content: Dict,
+    interactions: Dict,
+    policy_result: Dict,
+) -> AsyncIterator[str]:
+    """
+    Agent: Generate the safety report as a text stream.
+
+    Yields raw text: the markdown report, then REPORT_META_DELIMITER, then a JSON
+    object with "risk_title", "overall_risk_score" and "risk_summary". Use
+    `visible_report_text` while streaming and `parse_streamed_report` on the
+    assembled text to get the same dict `report_generator_agent` returns.
+    """
+    request = _report_stream_request(user_profile, underage, content, interactions, policy_result)
+    try:
+        async for chunk in _run_stream_agent_async(**request):
+            yield chunk
+    except Exception as e:
+        yield _report_stream_error(e)
+
+
+def visible_report_text(streamed_text: str) -> str:
+    """Return the markdown part of a partially streamed report."""
+    head = streamed_text.split(REPORT_META_DELIMITER, 1)[0]
+    # Hide a delimiter that has only partly arrived
+    idx = head.rfind("<<<")
+    if idx != -1 and REPORT_META_DELIMITER.startswith(head[idx:]):
+        head = head[:idx]
+    return head
+
+
+def parse_streamed_report(streamed_text: str) -> Dict:
+    """Split a fully streamed report into the `report_generator_agent` dict shape."""
+    body, _, meta_text = streamed_text.partition(REPORT_META_DELIMITER)
+    meta = _parse_json_content(meta_text.strip()) if meta_text.strip() else {}
+    if not body.strip() and not meta:
+        return {"error": "empty report stream"}
+    return {**meta, "markdown_report": body.strip()}
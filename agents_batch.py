@@ -0,0 +1,196 @@
+import io
+from pathlib import Path
+from typing import Dict, List
+
+import orjson
+
+from audit_store import save_audit
+from agents import (
+    client,
+    _dumps,
+    _loads,
+    _completion_kwargs,
+    _parse_json_content,
+    _underage_request,
+    _content_request,
+    _interaction_request,
+    _policy_request,
+    _report_request,
+    with_content_overall,
+)
+
+# Bulk audits go through the OpenAI Batch API: ~50% cheaper than synchronous
+# calls, completed within a 24h window. Agents depend on each other, so one
+# bulk audit is three batches run back to back:
+#   findings (underage + content + interaction) -> policy -> report
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_COMPLETION_WINDOW = "24h"
+AUDITS_DIR = Path("data") / "audits"
+
+TERMINAL_FAILURES = ("failed", "expired", "cancelled")
+
+
+def _batch_line(custom_id: str, request: Dict) -> Dict:
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": _completion_kwargs(**request),
+    }
+
+
+def _findings_lines(jobs: Dict[str, Dict]) -> List[Dict]:
+    lines = []
+    for uid, job in jobs.items():
+        lines.append(_batch_line(f"{uid}:underage", _underage_request(job["user_profile"], job["posts"])))
+        lines.append(_batch_line(f"{uid}:content", _content_request(job["posts"])))
+        lines.append(
+            _batch_line(
+                f"{uid}:interaction",
+                _interaction_request(job["user_profile"], job["interactions"]),
+            )
+        )
+    return lines
+
+
+def _policy_lines(results: Dict[str, Dict], policy_text: str) -> List[Dict]:
+    lines = []
+    for uid, res in results.items():
+        aggregated_findings = {
+            "underage": res.get("underage", {}),
+            "content": res.get("content", {}),
+            "interactions": res.get("interaction", {}),
+        }
+        lines.append(_batch_line(f"{uid}:policy", _policy_request(policy_text, aggregated_findings)))
+    return lines
+
+
+def _report_lines(jobs: Dict[str, Dict], results: Dict[str, Dict]) -> List[Dict]:
+    lines = []
+    for uid, res in results.items():
+        request = _report_request(
+            jobs[uid]["user_profile"],
+            res.get("underage", {}),
+            res.get("content", {}),
+            res.get("interaction", {}),
+            res.get("policy", {}),
+        )
+        lines.append(_batch_line(f"{uid}:report", request))
+    return lines
+
+
+def submit_batch(lines: List[Dict]) -> str:
+    """Upload request lines as a JSONL file and create a batch; returns the batch id."""
+    data = "\n".join(_dumps(line) for line in lines).encode("utf-8")
+    batch_file = client.files.create(file=("audit_batch.jsonl", io.BytesIO(data)), purpose="batch")
+    batch = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window=BATCH_COMPLETION_WINDOW,
+    )
+    return batch.id
+
+
+def _download_outputs(batch) -> Dict[str, Dict]:
+    """Read a completed batch's output file into {custom_id: parsed agent dict}."""
+    outputs = {}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for raw in client.files.content(file_id).text.splitlines():
+            if not raw.strip():
+                continue
+            record = _loads(raw)
+            response = record.get("response") or {}
+            if record.get("error") or response.get("status_code") != 200:
+                error = record.get("error") or response.get("body", {}).get("error")
+                outputs[record["custom_id"]] = {"error": f"LLM request failed: {error}"}
+                continue
+            try:
+                content = response["body"]["choices"][0]["message"]["content"]
+            except Exception:
+                outputs[record["custom_id"]] = {"error": "unexpected LLM response format"}
+                continue
+            outputs[record["custom_id"]] = _parse_json_content(content)
+    return outputs
+
+
+def start_bulk_audit(jobs: Dict[str, Dict], policy_text: str) -> Dict:
+    """
+    Submit the first stage of a bulk audit.
+
+    Input:
+      - jobs: {user_id: {"user_profile": {...}, "posts": [...], "interactions": [...]}}
+      - policy_text: raw company safety policies (string)
+
+    Returns a plain-dict state to keep in st.session_state and pass to
+    `poll_bulk_audit`.
+    """
+    return {
+        "stage": "findings",
+        "status": "submitted",
+        "batch_id": submit_batch(_findings_lines(jobs)),
+        "jobs": jobs,
+        "policy_text": policy_text,
+        "results": {uid: {} for uid in jobs},
+    }
+
+
+def poll_bulk_audit(state: Dict) -> Dict:
+    """
+    Check the current batch and advance the bulk audit when it completes.
+
+    Completed stages are demultiplexed by custom_id ("<user_id>:<agent>") into
+    state["results"]; after the report stage each user's results are written to
+    data/audits/<user_id>.json and the stage becomes "done".
+    """
+    if state["stage"] in ("done", "failed"):
+        return state
+
+    batch = client.batches.retrieve(state["batch_id"])
+    state["status"] = batch.status
+    if batch.status in TERMINAL_FAILURES:
+        state["stage"] = "failed"
+        return state
+    if batch.status != "completed":
+        return state
+
+    for custom_id, output in _download_outputs(batch).items():
+        uid, agent = custom_id.rsplit(":", 1)
+        if agent == "content":
+            output = with_content_overall(output)
+        if uid in state["results"]:
+            state["results"][uid][agent] = output
+
+    # Submit before touching the stage: if the upload fails, the state still
+    # points at the completed batch and the next poll retries this step
+    if state["stage"] == "findings":
+        batch_id = submit_batch(_policy_lines(state["results"], state["policy_text"]))
+        state.update(stage="policy", batch_id=batch_id, status="submitted")
+    elif state["stage"] == "policy":
+        batch_id = submit_batch(_report_lines(state["jobs"], state["results"]))
+        state.update(stage="report", batch_id=batch_id, status="submitted")
+    else:
+        save_audits(state["results"])
+        state["stage"] = "done"
+    return state
+
+
+AUDIT_AGENTS = ("underage", "content", "interaction", "policy", "report")
+
+
+def save_audits(results: Dict[str, Dict]) -> None:
+    """
+    Write each user's results to data/audits/<user_id>.json, and store the
+    complete, error-free ones in the audit store so the app reuses them
+    instead of re-running the agents for that user.
+    """
+    AUDITS_DIR.mkdir(parents=True, exist_ok=True)
+    for uid, res in results.items():
+        path = AUDITS_DIR / f"{uid}.json"
+        path.write_bytes(orjson.dumps(res, option=orjson.OPT_INDENT_2))
+        if all(
+            isinstance(res.get(agent), dict) and res[agent] and "error" not in res[agent]
+            for agent in AUDIT_AGENTS
+        ):
+            save_audit(uid, {agent: res[agent] for agent in AUDIT_AGENTS})
@@ -1,16 +1,36 @@
+import asyncio
 import os
+import threading
+import time
 from pathlib import Path
 
 import streamlit as st
 import pandas as pd
 
 from agents import (
-    underage_risk_agent,
-    content_risk_agent,
-    interaction_risk_agent,
-    policy_violation_agent,
-    report_generator_agent,
+    CACHE_STATS,
+    CONTENT_RISK_FIELDS,
+    RISK_LEVELS,
+    with_content_overall,
+    underage_risk_agent_async,
+    content_risk_agent_async,
+    interaction_risk_agent_async,
+    triage_agent_async,
+    triage_screen_async,
+    clean_audit_results,
+    fits_triage_budget,
+    SAFETY_RE,
+    merge_prefiltered_posts,
+    policy_violation_agent_stream_async,
+    preliminary_policy,
+    policy_diverges,
+    report_generator_agent_stream_async,
+    parse_streamed_policy,
+    visible_report_text,
+    parse_streamed_report,
 )
+from agents_batch import AUDITS_DIR, start_bulk_audit, poll_bulk_audit
+from audit_store import load_audit, save_audit
 
 # THEME & HEADER CSS 
 THEME_CSS = """
@@ -193,6 +213,7 @@ PROJECT_TAGLINE = "Making your social feed safer — one scroll at a time."
 POLICY_PATH = Path("policies") / "safety_policies.txt"
 
 
+@st.cache_data(show_spinner=False)
 def load_data():
     data_dir = Path("data")
     users = pd.read_csv(data_dir / "users.csv")
@@ -201,12 +222,296 @@ def load_data():
     return users, posts, interactions
 
 
+@st.cache_data
 def load_policies() -> str:
+    # Stripped once here so the policy prompt prefix is identical on every call
     if POLICY_PATH.exists():
-        return POLICY_PATH.read_text(encoding="utf-8")
+        return POLICY_PATH.read_text(encoding="utf-8").rstrip()
     return "No policies found."
 
 
+# Interaction fields the agents actually read; everything else is left out of the prompt
+INTERACTION_COLUMNS = ["interaction_id", "from_user", "to_user", "text", "from_age", "to_age"]
+
+
+def build_interaction_payload(user_interactions_df, users):
+    # Attach sender/recipient ages with two merges rather than a per-row lookup
+    age_df = users[["user_id", "age"]]
+    enriched = user_interactions_df.merge(
+        age_df.rename(columns={"user_id": "from_user", "age": "from_age"}),
+        on="from_user",
+        how="left",
+    ).merge(
+        age_df.rename(columns={"user_id": "to_user", "age": "to_age"}),
+        on="to_user",
+        how="left",
+    )
+    enriched[["from_age", "to_age"]] = enriched[["from_age", "to_age"]].fillna(-1).astype(int)
+    return enriched[INTERACTION_COLUMNS].to_dict(orient="records")
+
+
+def needs_interaction_review(interaction):
+    """
+    Keyword pre-filter for DMs. Adult-to-minor messages are always kept, since
+    repeated contact is itself a policy signal even when the text is neutral.
+    """
+    if interaction["from_age"] >= 18 and 0 <= interaction["to_age"] < 18:
+        return True
+    return bool(SAFETY_RE.search(str(interaction.get("text", ""))))
+
+
+def build_bulk_jobs(users, posts, interactions):
+    """Per-user agent inputs for every user, in the shape start_bulk_audit expects."""
+    jobs = {}
+    for user_row in users.to_dict(orient="records"):
+        uid = user_row["user_id"]
+        user_posts_df = posts[posts["user_id"] == uid]
+        user_interactions_df = interactions[
+            (interactions["from_user"] == uid) | (interactions["to_user"] == uid)
+        ]
+        jobs[uid] = {
+            "user_profile": user_row,
+            "posts": user_posts_df[["post_id", "text"]].to_dict(orient="records"),
+            "interactions": build_interaction_payload(user_interactions_df, users),
+        }
+    return jobs
+
+
+@st.cache_resource
+def audit_event_loop():
+    """
+    One long-lived event loop in a daemon thread for all audits.
+
+    Unlike asyncio.run(), the loop outlives a single call, so the report task
+    can keep streaming while the script thread renders the other results.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="audit-loop", daemon=True).start()
+    return loop
+
+
+def run_on_audit_loop(coro):
+    """Schedule a coroutine on the audit loop; returns a concurrent.futures.Future."""
+    return asyncio.run_coroutine_threadsafe(coro, audit_event_loop())
+
+
+class ReportDraft:
+    """Report text streamed on the audit loop and read from the script thread."""
+
+    def __init__(self, policy_basis):
+        # The policy result (possibly preliminary) the report is written from
+        self.policy_basis = policy_basis
+        self.text = ""
+        self.done = False
+        self.task = None
+
+
+async def _stream_report(draft, user_row, underage_res, content_res, interaction_res):
+    try:
+        async for chunk in report_generator_agent_stream_async(
+            user_row, underage_res, content_res, interaction_res, draft.policy_basis
+        ):
+            draft.text += chunk
+    finally:
+        draft.done = True
+
+
+def start_report(policy_basis, user_row, underage_res, content_res, interaction_res):
+    """Start streaming a report on the running loop from the given policy result."""
+    draft = ReportDraft(policy_basis)
+    draft.task = asyncio.create_task(
+        _stream_report(draft, user_row, underage_res, content_res, interaction_res)
+    )
+    return draft
+
+
+def save_if_complete(user_id, audit_results):
+    """Persist an audit whose agent results are all present and error-free."""
+    if all(isinstance(r, dict) and r and "error" not in r for r in audit_results.values()):
+        save_audit(user_id, audit_results)
+
+
+def save_when_report_done(user_id, results, draft):
+    """
+    Save the audit from the audit loop once the kept report finishes, so it is
+    persisted even if a rerun interrupts the script thread rendering it.
+    """
+    def on_done(task):
+        if task.cancelled() or task.exception() is not None:
+            return
+        save_if_complete(user_id, {**results, "report": parse_streamed_report(draft.text)})
+
+    draft.task.add_done_callback(on_done)
+
+
+async def score_content(content_posts):
+    """Content agent for the flagged posts; no LLM call when none are flagged."""
+    if not content_posts:
+        return with_content_overall({"per_post": []})
+    return await content_risk_agent_async(content_posts)
+
+
+async def run_audit(user_row, posts_payload, content_posts, inter_payload, policies_text):
+    """
+    Run the analysis agents for one user.
+
+    posts_payload is every post (the pre-screen and underage assessment read
+    writing style from all of them); content_posts is the subset the keyword
+    pre-filter flagged, the only posts content risk is scored on.
+
+    A cheap pre-screen runs first; users it clears get locally built no-risk
+    results (report included) and no further LLM calls.
+
+    Otherwise the underage, content and interaction assessments run as one
+    fused triage call; if the input is over budget or the call fails, the three
+    single agents are dispatched concurrently instead. Policy depends on their
+    findings and is streamed: as soon as its severity, recommended action and
+    violated sections have arrived, the report starts in the background from
+    that preliminary decision, overlapping the rest of the policy decode. If
+    the final policy diverges from it, the report is cancelled and restarted
+    from the final one, so the report kept always matches the final decision.
+
+    Posts the pre-filter skipped are merged back into content as "none"
+    entries, and the audit is saved to the audit store from the loop (once the
+    report finishes, when it streams), independent of the page rendering it.
+
+    Must run on `audit_event_loop`. Returns the four agent results plus either
+    a finished report dict or a still-streaming ReportDraft (the other is None).
+    """
+    user_id = user_row["user_id"]
+    content_ids = [p["post_id"] for p in content_posts]
+    flagged_ids = set(content_ids)
+    skipped_posts = [p for p in posts_payload if p["post_id"] not in flagged_ids]
+
+    screen = await triage_screen_async(user_row, posts_payload, inter_payload)
+    if not screen["needs_full_audit"]:
+        clean = clean_audit_results(user_row, content_posts, screen["reason"])
+        clean["content"] = merge_prefiltered_posts(clean["content"], skipped_posts)
+        save_if_complete(user_id, clean)
+        return (
+            clean["underage"],
+            clean["content"],
+            clean["interaction"],
+            clean["policy"],
+            clean["report"],
+            None,
+        )
+
+    triage_res = {}
+    if fits_triage_budget(user_row, posts_payload, inter_payload, content_ids):
+        triage_res = await triage_agent_async(user_row, posts_payload, inter_payload, content_ids)
+
+    if all(isinstance(triage_res.get(k), dict) for k in ("underage", "content", "interaction")):
+        underage_res = triage_res["underage"]
+        content_res = triage_res["content"]
+        interaction_res = triage_res["interaction"]
+        # The fused call can truncate per_post for large users; rescore just content
+        if content_posts and len(content_res.get("per_post") or []) != len(content_posts):
+            content_res = await content_risk_agent_async(content_posts)
+    else:
+        underage_res, content_res, interaction_res = await asyncio.gather(
+            underage_risk_agent_async(user_row, posts_payload),
+            score_content(content_posts),
+            interaction_risk_agent_async(user_row, inter_payload),
+        )
+
+    aggregated_findings = {
+        "underage": underage_res,
+        "content": content_res,
+        "interactions": interaction_res,
+    }
+
+    findings = (user_row, underage_res, content_res, interaction_res)
+    draft = None
+    streamed = ""
+    try:
+        async for chunk in policy_violation_agent_stream_async(policies_text, aggregated_findings):
+            streamed += chunk
+            if draft is None:
+                prelim = preliminary_policy(streamed)
+                if prelim is not None:
+                    draft = start_report(prelim, *findings)
+        policy_res = parse_streamed_policy(streamed)
+    except Exception as e:
+        policy_res = {"error": f"LLM request failed: {e}"}
+
+    if draft is None or policy_diverges(draft.policy_basis, policy_res):
+        if draft is not None:
+            draft.task.cancel()
+        draft = start_report(policy_res, *findings)
+
+    content_res = merge_prefiltered_posts(content_res, skipped_posts)
+    results = {
+        "underage": underage_res,
+        "content": content_res,
+        "interaction": interaction_res,
+        "policy": policy_res,
+    }
+    save_when_report_done(user_id, results, draft)
+    return underage_res, content_res, interaction_res, policy_res, None, draft
+
+
+def render_cache_stats(slot):
+    """
+    Show the response cache counters. Only the JSON agent calls (pre-screen,
+    triage and the single agents) go through the cache; the streamed policy
+    and report calls bypass it.
+    """
+    st.session_state["llm_cache_stats"] = dict(CACHE_STATS)
+    slot.caption(
+        f"LLM response cache: {CACHE_STATS['hits']} hits / {CACHE_STATS['misses']} misses "
+        "(streamed policy/report calls are not cached)"
+    )
+
+
+def audit_in_flight(audit):
+    """
+    True while an audit Future from `run_on_audit_loop` is still running, or
+    its report is still streaming in the background.
+    """
+    if audit is None:
+        return False
+    if not audit.done():
+        return True
+    if audit.cancelled() or audit.exception() is not None:
+        return False
+    report_draft = audit.result()[5]
+    return report_draft is not None and not report_draft.done
+
+
+def render_report_header(report_res):
+    st.write(
+        "**Title:**",
+        report_res.get("risk_title", f"{PROJECT_NAME} Safety Report"),
+    )
+    st.write(
+        "**Overall Risk Score:**",
+        report_res.get("overall_risk_score", "N/A"),
+    )
+    st.write("**Summary:**", report_res.get("risk_summary", ""))
+
+
+@st.fragment(run_every=60)
+def bulk_audit_status():
+    """Poll the running bulk audit (if any) once a minute without rerunning the page."""
+    state = st.session_state.get("bulk_audit")
+    if not state:
+        return
+    try:
+        poll_bulk_audit(state)
+    except Exception as e:
+        st.warning(f"Could not check bulk audit status: {e}")
+    if state["stage"] == "done":
+        st.success(f"Bulk audit completed. Results saved to `{AUDITS_DIR}/`.")
+    elif state["stage"] == "failed":
+        st.error(f"Bulk audit batch `{state['batch_id']}` ended as **{state['status']}**.")
+    else:
+        st.info(
+            f"Bulk audit in progress — stage **{state['stage']}**, "
+            f"batch `{state['batch_id']}` is **{state['status']}**."
+        )
+
+
 def main():
     # Inject CSS theme
     st.markdown(THEME_CSS, unsafe_allow_html=True)
@@ -254,6 +559,14 @@ All data here is synthetic and for research/demo purposes only.
     st.sidebar.write("Users table preview:")
     st.sidebar.dataframe(users.head(), height=200)
 
+    force_reaudit = st.sidebar.toggle(
+        "Force re-audit", help="Ignore the saved audit for this user and call the agents again."
+    )
+
+    # Filled in again after the audit block so the counters include this run
+    cache_stats_slot = st.sidebar.empty()
+    render_cache_stats(cache_stats_slot)
+
     user_row = users[users["user_id"] == selected_user_id].iloc[0].to_dict()
     user_posts_df = posts[posts["user_id"] == selected_user_id]
     user_interactions_df = interactions[
@@ -292,7 +605,18 @@ All data here is synthetic and for research/demo purposes only.
     if DEMO_MODE:
         st.info("Running in DEMO MODE — no OpenAI key detected. Showing mock results only.")
 
-    if st.button("Run Multi-Agent Safety Audit"):
+    # One audit per user at a time: repeated clicks would start overlapping,
+    # fully billed runs against the same user. The audit runs on the audit
+    # loop and outlives a script rerun, so its Future is what marks it in flight.
+    inflight_key = f"inflight_{selected_user_id}"
+    audit_running = audit_in_flight(st.session_state.get(inflight_key))
+    if st.button("Run Multi-Agent Safety Audit", disabled=audit_running):
+        if audit_running:
+            st.warning("Audit already running for this user.")
+            st.stop()
+        stored = None
+        # Set when the report is still streaming on the audit loop
+        report_draft = None
         # If in demo mode, use canned results (no external calls)
         if DEMO_MODE:
             # Mock outputs for UI/screenshot purposes
@@ -364,31 +688,44 @@ All data here is synthetic and for research/demo purposes only.
                 )
                 return
 
-            with st.spinner("Agents are analyzing this user..."):
-                posts_payload = user_posts_df[["post_id", "text"]].to_dict(orient="records")
-
-                users_age_map = dict(zip(users["user_id"], users["age"]))
-                inter_payload = []
-                for _, row in user_interactions_df.iterrows():
-                    r = row.to_dict()
-                    r["from_age"] = int(users_age_map.get(r["from_user"], -1))
-                    r["to_age"] = int(users_age_map.get(r["to_user"], -1))
-                    inter_payload.append(r)
-
-                underage_res = underage_risk_agent(user_row, posts_payload)
-                content_res = content_risk_agent(posts_payload)
-                interaction_res = interaction_risk_agent(user_row, inter_payload)
-
-                aggregated_findings = {
-                    "underage": underage_res,
-                    "content": content_res,
-                    "interactions": interaction_res,
-                }
-
-                policy_res = policy_violation_agent(policies_text, aggregated_findings)
-                report_res = report_generator_agent(
-                    user_row, underage_res, content_res, interaction_res, policy_res
-                )
+            if not force_reaudit:
+                stored = load_audit(selected_user_id)
+            if stored:
+                underage_res = stored["underage"]
+                content_res = stored["content"]
+                interaction_res = stored["interaction"]
+                policy_res = stored["policy"]
+                report_res = stored["report"]
+                saved_at = pd.Timestamp(stored["created_at"], unit="s").strftime("%Y-%m-%d %H:%M")
+                st.caption(f"Showing saved audit from {saved_at} UTC. Use **Force re-audit** to refresh.")
+            else:
+                with st.spinner("Agents are analyzing this user..."):
+                    # Only posts the keyword pre-filter flags are scored for
+                    # content risk; underage and the pre-screen see them all
+                    flagged = user_posts_df["text"].str.contains(SAFETY_RE, regex=True, na=False)
+                    posts_payload = user_posts_df[["post_id", "text"]].to_dict(orient="records")
+                    content_posts = user_posts_df[flagged][["post_id", "text"]].to_dict(orient="records")
+
+                    inter_payload = [
+                        r
+                        for r in build_interaction_payload(user_interactions_df, users)
+                        if needs_interaction_review(r)
+                    ]
+
+                    audit = run_on_audit_loop(
+                        run_audit(
+                            user_row, posts_payload, content_posts, inter_payload, policies_text
+                        )
+                    )
+                    st.session_state[inflight_key] = audit
+                    (
+                        underage_res,
+                        content_res,
+                        interaction_res,
+                        policy_res,
+                        report_res,
+                        report_draft,
+                    ) = audit.result()
 
         st.success("Safety audit completed.")
 
@@ -410,16 +747,13 @@ All data here is synthetic and for research/demo purposes only.
         with col_right:
             # Risk chart
             st.markdown("### 📊 Risk Overview (Content)")
-            risk_map = {"none": 0, "low": 1, "medium": 2, "high": 3, "critical": 4}
             if "overall" in content_res:
                 overall = content_res["overall"]
-                bullying = risk_map.get(overall.get("bullying_risk", "none"), 0)
-                selfharm = risk_map.get(overall.get("self_harm_risk", "none"), 0)
-                sexual = risk_map.get(overall.get("sexual_exploitation_risk", "none"), 0)
-                substance = risk_map.get(
-                    overall.get("substance_abuse_risk", "none"), 0
+                levels = pd.Categorical(
+                    [overall.get(field, "none") for field in CONTENT_RISK_FIELDS],
+                    categories=RISK_LEVELS,
+                    ordered=True,
                 )
-
                 risk_df = pd.DataFrame(
                     {
                         "Risk type": [
@@ -428,7 +762,8 @@ All data here is synthetic and for research/demo purposes only.
                             "Sexual exploitation",
                             "Substance abuse",
                         ],
-                        "Severity (0–4)": [bullying, selfharm, sexual, substance],
+                        # Category codes are the 0-4 severity; unknown levels (-1) show as 0
+                        "Severity (0–4)": levels.codes.clip(min=0),
                     }
                 ).set_index("Risk type")
 
@@ -440,16 +775,21 @@ All data here is synthetic and for research/demo purposes only.
             st.json(policy_res)
 
             st.markdown("### 🔝 Final Safety Report")
-            if report_res:
-                st.write(
-                    "**Title:**",
-                    report_res.get("risk_title", f"{PROJECT_NAME} Safety Report"),
-                )
-                st.write(
-                    "**Overall Risk Score:**",
-                    report_res.get("overall_risk_score", "N/A"),
-                )
-                st.write("**Summary:**", report_res.get("risk_summary", ""))
+            if report_draft is not None:
+                # The report is still streaming on the audit loop; follow it here
+                header_slot = st.empty()
+                st.markdown("---")
+                body_slot = st.empty()
+                with st.spinner("Preparing the downloadable report..."):
+                    while not report_draft.done:
+                        body_slot.markdown(visible_report_text(report_draft.text))
+                        time.sleep(0.1)
+                report_res = parse_streamed_report(report_draft.text)
+                body_slot.markdown(report_res.get("markdown_report", ""))
+                with header_slot.container():
+                    render_report_header(report_res)
+            elif report_res:
+                render_report_header(report_res)
                 st.markdown("---")
                 st.markdown(report_res.get("markdown_report", ""))
             else:
@@ -468,10 +808,29 @@ All data here is synthetic and for research/demo purposes only.
                     mime="text/plain",
                 )
 
+    render_cache_stats(cache_stats_slot)
+
+    if not DEMO_MODE:
+        st.markdown("---")
+        st.markdown("## 🗂️ Bulk Audit")
+        st.write(
+            "Audit every user through the OpenAI Batch API. Results arrive within 24h "
+            f"and are saved to `{AUDITS_DIR}/<user_id>.json`."
+        )
+        running = st.session_state.get("bulk_audit", {}).get("stage") not in (None, "done", "failed")
+        if st.button("Bulk audit (overnight, 50% cheaper)", disabled=running):
+            try:
+                st.session_state["bulk_audit"] = start_bulk_audit(
+                    build_bulk_jobs(users, posts, interactions), policies_text
+                )
+            except Exception as e:
+                st.error(f"Could not submit bulk audit: {e}")
+        bulk_audit_status()
+
     st.markdown("---")
     st.markdown("### 📘 Safety Policies Used")
     with st.expander("View policies"):
-        st.text(load_policies())
+        st.text(policies_text)
 
 
 if __name__ == "__main__":
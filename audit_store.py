@@ -0,0 +1,50 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+import orjson
+
+# Completed audits keyed by user_id, so a re-run (or a new session) can render
+# saved results instead of calling the LLM again.
+AUDIT_DB_PATH = Path("audits.db")
+
+# One connection shared by all Streamlit sessions; sqlite3 objects aren't safe
+# for concurrent use, so access goes through the lock.
+_conn = sqlite3.connect(str(AUDIT_DB_PATH), check_same_thread=False)
+_conn.execute(
+    "CREATE TABLE IF NOT EXISTS results ("
+    "user_id TEXT PRIMARY KEY, payload BLOB, created_at REAL)"
+)
+_lock = threading.Lock()
+
+
+def load_audit(user_id: str) -> Optional[Dict]:
+    """
+    Return the saved audit for a user, or None.
+
+    Output structure: {"underage", "content", "interaction", "policy", "report",
+    "created_at"} where the first five are the agent results.
+    """
+    with _lock:
+        row = _conn.execute(
+            "SELECT payload, created_at FROM results WHERE user_id = ?", (user_id,)
+        ).fetchone()
+    if row is None:
+        return None
+    audit = orjson.loads(row[0])
+    audit["created_at"] = row[1]
+    return audit
+
+
+def save_audit(user_id: str, results: Dict) -> None:
+    """Insert or replace the saved audit for a user."""
+    payload = orjson.dumps(results, option=orjson.OPT_SERIALIZE_NUMPY)
+    with _lock, _conn:
+        _conn.execute(
+            "INSERT INTO results (user_id, payload, created_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET "
+            "payload = excluded.payload, created_at = excluded.created_at",
+            (str(user_id), payload, time.time()),
+        )
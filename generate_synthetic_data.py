@@ -1,137 +1,474 @@
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import argparse
-import random
+import multiprocessing
+import numpy as np
 import pandas as pd
 import datetime as dt
 
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from pyarrow import csv as pacsv
+except ImportError:  # optional: multi-threaded CSV writer, streamed binary outputs
+    pa = None
 
-def generate_users(n=20, start_date="2024-01-01"):
-    user_ids = [f"u{i+1}" for i in range(n)]
-    ages = [random.choice([13, 14, 15, 16, 17, 18, 21, 25, 30]) for _ in range(n)]
-    account_types = [random.choice(["standard", "creator", "business"]) for _ in range(n)]
-    created_at = pd.date_range(start_date, periods=n).tolist()
+try:
+    from numba import njit
+except ImportError:  # optional: compiled post-text kernel
+    njit = None
 
-    return pd.DataFrame(
-        {
-            "user_id": user_ids,
-            "age": ages,
-            "account_type": account_types,
-            "created_at": created_at,
-        }
-    )
+AGES = np.array([13, 14, 15, 16, 17, 18, 21, 25, 30], dtype=np.int8)
+ACCT = np.array(["standard", "creator", "business"])
 
-
-def sample_post_text(user_age):
-    risky_self_harm = [
+RISKY_SELF_HARM = np.array(
+    [
         "I feel like nothing matters anymore.",
         "Sometimes I just want to disappear.",
         "I have not eaten properly in days.",
-    ]
-    risky_bully = [
+    ],
+    dtype=object,
+)
+RISKY_BULLY = np.array(
+    [
         "You are so ugly lol.",
         "Nobody likes you, just leave.",
         "You are a loser, everyone knows it.",
-    ]
-    risky_grooming = [
+    ],
+    dtype=object,
+)
+RISKY_GROOMING = np.array(
+    [
         "Don't tell your parents we talk here.",
         "Keep our chats secret okay?",
-        "You can trust me, I’m older and I know better.",
-    ]
-    risky_substance = [
+        "You can trust me, I'm older and I know better.",
+    ],
+    dtype=object,
+)
+RISKY_SUBSTANCE = np.array(
+    [
         "Got so drunk last night lol.",
         "Trying pills for the first time haha.",
         "Smoking every day now, feels great.",
-    ]
-    safe = [
+    ],
+    dtype=object,
+)
+SAFE_POSTS = np.array(
+    [
         "Exam went well today.",
         "Had a great day with friends!",
         "Practicing for my football match.",
         "Studying hard for JEE.",
         "Watching movies with family.",
-    ]
-
-    bucket = random.random()
-    if user_age < 18:
-        if bucket < 0.15:
-            return random.choice(risky_self_harm)
-        elif bucket < 0.3:
-            return random.choice(risky_bully)
-        elif bucket < 0.4:
-            return random.choice(risky_grooming)
-        else:
-            return random.choice(safe)
-    else:
-        if bucket < 0.15:
-            return random.choice(risky_substance)
-        elif bucket < 0.3:
-            return random.choice(risky_grooming)
-        elif bucket < 0.4:
-            return random.choice(risky_bully)
-        else:
-            return random.choice(safe)
-
-
-def generate_posts(users_df, posts_per_user=5, start_ts="2024-03-01"):
-    rows = []
-    post_id = 1
+    ],
+    dtype=object,
+)
+
+# Category pools in one flat string array; the per-age-group orders index
+# into it by pool number
+_POST_POOLS = [RISKY_SELF_HARM, RISKY_BULLY, RISKY_GROOMING, RISKY_SUBSTANCE, SAFE_POSTS]
+POST_STRINGS = np.concatenate(_POST_POOLS)
+POST_POOL_SIZES = np.array([len(pool) for pool in _POST_POOLS], dtype=np.int64)
+POST_POOL_STARTS = np.cumsum(POST_POOL_SIZES) - POST_POOL_SIZES
+POST_POOLS_MINOR = np.array([0, 1, 2, 4], dtype=np.int64)
+POST_POOLS_ADULT = np.array([3, 2, 1, 4], dtype=np.int64)
+POST_THRESHOLDS = np.array([0.15, 0.3, 0.4, 1.0])
+
+RISKY_DM = np.array(
+    [
+        "Don't tell anyone we talk here.",
+        "I can send you pics but keep it secret.",
+        "We should meet alone sometime.",
+    ],
+    dtype=object,
+)
+NEUTRAL_DM = np.array(
+    [
+        "Hey, how are your exams going?",
+        "Let's play BGMI later.",
+        "Did you finish the homework?",
+    ],
+    dtype=object,
+)
+DM_POOLS = [RISKY_DM, NEUTRAL_DM]
+DM_THRESHOLDS = np.array([0.4, 1.0])  # 40% of DMs are risky
+
+
+def generate_users(rng, n=20, start_date="2024-01-01", first_id=1):
+    user_ids = np.char.add("u", np.arange(first_id, first_id + n).astype(str))
+    ages = rng.choice(AGES, size=n)
+    account_types = rng.choice(ACCT, size=n)
+    # One signup per day from start_date, continuing across shards
+    first_day = pd.Timestamp(start_date) + pd.Timedelta(days=first_id - 1)
+    created_at = pd.date_range(first_day, periods=n)
+
+    return pd.DataFrame(
+        {
+            "user_id": user_ids,
+            "age": ages,
+            "account_type": pd.Categorical(account_types, categories=ACCT),
+            "created_at": created_at,
+        }
+    )
+
+
+def sample_post_texts(ages, rng):
+    buckets = rng.random(len(ages))
+    draws = rng.random(len(ages))
+    idx = _post_text_indices(
+        ages < 18,
+        buckets,
+        draws,
+        POST_THRESHOLDS,
+        POST_POOLS_MINOR,
+        POST_POOLS_ADULT,
+        POST_POOL_STARTS,
+        POST_POOL_SIZES,
+    )
+    return POST_STRINGS[idx]
+
+
+def _post_text_indices_numpy(
+    minor, buckets, draws, thresholds, pools_minor, pools_adult, starts, sizes
+):
+    cat = np.searchsorted(thresholds, buckets, side="right")
+    pool = np.where(minor, pools_minor[cat], pools_adult[cat])
+    return starts[pool] + (draws * sizes[pool]).astype(np.int64)
+
+
+if njit is not None:
+
+    # Serial on purpose: this runs on ThreadPoolExecutor workers, and a
+    # parallel=True kernel called from a pool thread hangs interpreter exit
+    # under numba's TBB threading layer
+    @njit(cache=True)
+    def _post_text_indices(
+        minor, buckets, draws, thresholds, pools_minor, pools_adult, starts, sizes
+    ):
+        """
+        Index into the flat post-text array for each post: bucket -> category
+        (first threshold above it) -> pool for the age group -> uniform pick.
+        Same result as `_post_text_indices_numpy`.
+        """
+        out = np.empty(buckets.size, dtype=np.int64)
+        for i in range(buckets.size):
+            cat = 0
+            while cat < thresholds.size - 1 and buckets[i] >= thresholds[cat]:
+                cat += 1
+            pool = pools_minor[cat] if minor[i] else pools_adult[cat]
+            out[i] = starts[pool] + np.int64(draws[i] * sizes[pool])
+        return out
+
+else:
+    _post_text_indices = _post_text_indices_numpy
+
+
+def pick_from_pools(buckets, thresholds, pools, rng):
+    """
+    Pick one text per bucket value: the category is the first cumulative
+    threshold above the value, then a uniform pick within that category's pool.
+    """
+    cat = np.searchsorted(thresholds, buckets, side="right")
+    out = np.empty(len(buckets), dtype=object)
+    for k, pool in enumerate(pools):
+        idx = np.flatnonzero(cat == k)
+        out[idx] = pool[rng.integers(0, len(pool), size=idx.size)]
+    return out
+
+
+def generate_posts(
+    rng, users_df, posts_per_user=5, start_ts="2024-03-01", first_id=1, user_range=None
+):
+    # user_range=(start, stop) generates only those users' posts, e.g. one chunk
+    start, stop = user_range or (0, len(users_df))
+    m = (stop - start) * posts_per_user
+    # user_id is stored as codes into the users table (low cardinality per post)
+    user_codes = np.repeat(np.arange(start, stop), posts_per_user)
+    ages = users_df["age"].to_numpy()[user_codes]
     base = pd.Timestamp(start_ts)
-    for _, row in users_df.iterrows():
-        for _ in range(posts_per_user):
-            rows.append(
-                {
-                    "post_id": f"p{post_id}",
-                    "user_id": row["user_id"],
-                    "text": sample_post_text(row["age"]),
-                    "timestamp": base + pd.Timedelta(days=random.randint(0, 60)),
-                }
-            )
-            post_id += 1
-    return pd.DataFrame(rows)
 
+    return pd.DataFrame(
+        {
+            "post_id": np.arange(first_id, first_id + m, dtype=np.int32),
+            "user_id": pd.Categorical.from_codes(user_codes, categories=users_df["user_id"]),
+            "text": sample_post_texts(ages, rng),
+            "timestamp": base + pd.to_timedelta(rng.integers(0, 61, size=m), unit="D"),
+        }
+    )
 
-def generate_interactions(users_df, n_interactions=60, start_ts="2024-03-01"):
-    rows = []
-    user_ids = users_df["user_id"].tolist()
-    ages = dict(zip(users_df["user_id"], users_df["age"]))
 
-    def sample_dm_text(older, younger):
-        risky = [
-            "Don't tell anyone we talk here.",
-            "I can send you pics but keep it secret.",
-            "We should meet alone sometime.",
-        ]
-        neutral = [
-            "Hey, how are your exams going?",
-            "Let's play BGMI later.",
-            "Did you finish the homework?",
-        ]
-        return random.choice(risky if random.random() < 0.4 else neutral)
+def generate_interactions(
+    rng, users_df, n_interactions=60, start_ts="2024-03-01", first_id=1
+):
+    user_ids = users_df["user_id"].to_numpy()
+    ages = users_df["age"].to_numpy()
+    n_users = len(user_ids)
+
+    # Offsetting by 1..n_users-1 (mod n_users) gives a distinct second user
+    # without rejection sampling
+    i1 = rng.integers(0, n_users, size=n_interactions)
+    i2 = (i1 + rng.integers(1, n_users, size=n_interactions)) % n_users
+    first_older = ages[i1] > ages[i2]
+    older = pd.Categorical.from_codes(np.where(first_older, i1, i2), categories=user_ids)
+    younger = pd.Categorical.from_codes(np.where(first_older, i2, i1), categories=user_ids)
 
     base = pd.Timestamp(start_ts)
-    for i in range(n_interactions):
-        u1, u2 = random.sample(user_ids, 2)
-        a1, a2 = ages[u1], ages[u2]
-        older, younger = (u1, u2) if a1 > a2 else (u2, u1)
-
-        rows.append(
-            {
-                "interaction_id": f"i{i+1}",
-                "from_user": older,
-                "to_user": younger,
-                "type": "dm",
-                "text": sample_dm_text(older, younger),
-                "timestamp": base + pd.Timedelta(days=random.randint(0, 60)),
-            }
+    return pd.DataFrame(
+        {
+            "interaction_id": np.arange(first_id, first_id + n_interactions, dtype=np.int32),
+            "from_user": older,
+            "to_user": younger,
+            "type": pd.Categorical.from_codes(np.zeros(n_interactions, dtype=np.int8), ["dm"]),
+            "text": pick_from_pools(rng.random(n_interactions), DM_THRESHOLDS, DM_POOLS, rng),
+            "timestamp": base + pd.to_timedelta(rng.integers(0, 61, size=n_interactions), unit="D"),
+        }
+    )
+
+
+def _csv_table(df):
+    """
+    Arrow table for pyarrow's CSV writer: all-midnight datetime columns become
+    dates ("2024-03-01", as pandas writes them) instead of full nanosecond
+    timestamps.
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    for i, field in enumerate(table.schema):
+        if pa.types.is_timestamp(field.type):
+            col = df[field.name]
+            if (col == col.dt.normalize()).all():
+                table = table.set_column(i, field.name, table.column(i).cast(pa.date32()))
+    return table
+
+
+def write_csv(df, path: Path):
+    # pyarrow quotes every string field and header name, unlike pandas; the
+    # values parse back the same, but the files are not byte-identical to
+    # DataFrame.to_csv output
+    if pa is not None:
+        pacsv.write_csv(_csv_table(df), str(path))
+    else:
+        df.to_csv(path, index=False)
+
+
+OUTPUT_FORMATS = ("csv", "parquet", "feather")
+
+
+# Post and interaction ids are generated as int32 and only rendered to their
+# "p<N>" / "i<N>" string form when written
+ID_PREFIXES = {"post_id": "p", "interaction_id": "i"}
+
+
+def render_ids(df):
+    ids = {
+        col: np.char.add(prefix, df[col].to_numpy().astype(str))
+        for col, prefix in ID_PREFIXES.items()
+        if col in df.columns
+    }
+    return df.assign(**ids) if ids else df
+
+
+def write_frame(df, path: Path, fmt: str):
+    df = render_ids(df)
+    if fmt == "parquet":
+        df.to_parquet(path, engine="pyarrow", compression="zstd", index=False)
+    elif fmt == "feather":
+        df.reset_index(drop=True).to_feather(path, compression="zstd")
+    else:
+        write_csv(df, path)
+
+
+def output_paths(data_dir: Path, prefix: str, fmt: str):
+    return [data_dir / f"{prefix}_{name}.{fmt}" for name in ("users", "posts", "interactions")]
+
+
+def save_data(data_dir: Path, prefix: str, users, posts, interactions, fmt="feather"):
+    data_dir.mkdir(parents=True, exist_ok=True)
+    frames = (users, posts, interactions)
+    # pandas/pyarrow writers release the GIL, so threads overlap the three writes
+    with ThreadPoolExecutor(max_workers=len(frames)) as ex:
+        futures = [
+            ex.submit(write_frame, df, path, fmt)
+            for df, path in zip(frames, output_paths(data_dir, prefix, fmt))
+        ]
+        for future in futures:
+            future.result()
+
+
+# Posts tables above this many rows are generated and written chunk by chunk
+POST_CHUNK_ROWS = 1_000_000
+
+
+def _open_batch_writer(path: Path, schema, fmt: str):
+    if fmt == "parquet":
+        return pq.ParquetWriter(str(path), schema, compression="zstd")
+    options = pa.ipc.IpcWriteOptions(compression="zstd")
+    return pa.ipc.new_file(str(path), schema, options=options)
+
+
+def iter_post_chunks(rng, users_df, posts_per_user, first_id=1):
+    """
+    Yield the posts table in chunks of about POST_CHUNK_ROWS rows. Both the
+    in-memory and the streamed outputs are built from these chunks, so a
+    seeded run draws in the same order and gives the same posts in every
+    output format.
+    """
+    users_per_chunk = max(1, POST_CHUNK_ROWS // max(posts_per_user, 1))
+    # At least one (possibly empty) chunk, so callers always get a schema
+    for start in range(0, max(len(users_df), 1), users_per_chunk):
+        stop = min(start + users_per_chunk, len(users_df))
+        yield generate_posts(
+            rng,
+            users_df,
+            posts_per_user,
+            first_id=first_id + start * posts_per_user,
+            user_range=(start, stop),
         )
 
-    return pd.DataFrame(rows)
 
+def generate_posts_chunked(rng, users_df, posts_per_user, first_id=1):
+    return pd.concat(
+        iter_post_chunks(rng, users_df, posts_per_user, first_id), ignore_index=True
+    )
+
+
+def stream_posts(rng, users_df, posts_per_user, path: Path, fmt: str, first_id=1):
+    """
+    Append each `iter_post_chunks` chunk to one Feather (Arrow IPC) or Parquet
+    file as a record batch, so memory stays bounded by the chunk rather than
+    the whole table.
+    """
+    schema = None
+    writer = None
+    try:
+        for chunk in iter_post_chunks(rng, users_df, posts_per_user, first_id):
+            batch = pa.RecordBatch.from_pandas(
+                render_ids(chunk), schema=schema, preserve_index=False
+            )
+            if writer is None:
+                schema = batch.schema
+                writer = _open_batch_writer(path, schema, fmt)
+            writer.write_batch(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def write_dataset(
+    rng, n_users, posts_per_user, n_interactions, data_dir: Path, prefix, fmt, first_ids=(1, 1, 1)
+):
+    """
+    Generate and write one dataset; returns the output paths. Large posts
+    tables in Feather/Parquet are streamed with `stream_posts` instead of
+    being built in memory.
+    """
+    paths = output_paths(data_dir, prefix, fmt)
+    if fmt == "csv" or n_users * posts_per_user <= POST_CHUNK_ROWS:
+        users, posts, interactions = generate_dataset(
+            rng, n_users, posts_per_user, n_interactions, first_ids
+        )
+        save_data(data_dir, prefix, users, posts, interactions, fmt=fmt)
+        return paths
 
-def save_data(data_dir: Path, prefix: str, users, posts, interactions):
+    first_user, first_post, first_interaction = first_ids
+    posts_rng, inter_rng = rng.spawn(2)
+    users = generate_users(rng, n_users, first_id=first_user)
+    interactions = generate_interactions(
+        inter_rng, users, n_interactions=n_interactions, first_id=first_interaction
+    )
+    users_path, posts_path, inter_path = paths
     data_dir.mkdir(parents=True, exist_ok=True)
-    users.to_csv(data_dir / f"{prefix}_users.csv", index=False)
-    posts.to_csv(data_dir / f"{prefix}_posts.csv", index=False)
-    interactions.to_csv(data_dir / f"{prefix}_interactions.csv", index=False)
+    with ThreadPoolExecutor(max_workers=3) as ex:
+        futures = [
+            ex.submit(stream_posts, posts_rng, users, posts_per_user, posts_path, fmt, first_post),
+            ex.submit(write_frame, users, users_path, fmt),
+            ex.submit(write_frame, interactions, inter_path, fmt),
+        ]
+        for future in futures:
+            future.result()
+    return paths
+
+
+def generate_dataset(rng, n_users, posts_per_user, n_interactions, first_ids=(1, 1, 1)):
+    """
+    Generate users, posts and interactions. first_ids are the first user,
+    post and interaction numbers, so shards can number their rows disjointly.
+    """
+    first_user, first_post, first_interaction = first_ids
+    # The concurrent steps get spawned child generators so the output doesn't
+    # depend on thread scheduling
+    posts_rng, inter_rng = rng.spawn(2)
+
+    users = generate_users(rng, n_users, first_id=first_user)
+    # Posts and interactions only depend on users; generate them concurrently
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        f_posts = ex.submit(
+            generate_posts_chunked, posts_rng, users, posts_per_user, first_id=first_post
+        )
+        f_inter = ex.submit(
+            generate_interactions,
+            inter_rng,
+            users,
+            n_interactions=n_interactions,
+            first_id=first_interaction,
+        )
+        return users, f_posts.result(), f_inter.result()
+
+
+def _gen_shard(
+    shard_id, n_users, posts_per_user, n_interactions, first_ids, seed_seq, out_dir, prefix, fmt
+):
+    """Generate and write one shard; runs in a worker process."""
+    rng = np.random.default_rng(seed_seq)
+    return write_dataset(
+        rng,
+        n_users,
+        posts_per_user,
+        n_interactions,
+        Path(out_dir),
+        f"{prefix}_shard{shard_id}",
+        fmt,
+        first_ids,
+    )
+
+
+def split_evenly(total, parts):
+    return [total // parts + (1 if k < total % parts else 0) for k in range(parts)]
+
+
+def generate_shards(args, workers):
+    """
+    Split users and interactions into `workers` independent shards and generate
+    them in parallel processes. Each shard has its own child SeedSequence and
+    its own id range, so a seeded run is reproducible and ids are unique
+    across shards; interactions stay within a shard's users.
+    """
+    seeds = np.random.SeedSequence(args.seed).spawn(workers)
+    user_counts = split_evenly(args.users, workers)
+    inter_counts = split_evenly(args.interactions, workers)
+
+    jobs = []
+    first_user = first_interaction = 1
+    for shard_id, (n_users, n_inter) in enumerate(zip(user_counts, inter_counts)):
+        first_post = (first_user - 1) * args.posts_per_user + 1
+        jobs.append(
+            (
+                shard_id,
+                n_users,
+                args.posts_per_user,
+                n_inter,
+                (first_user, first_post, first_interaction),
+                seeds[shard_id],
+                args.out_dir,
+                args.prefix,
+                args.format,
+            )
+        )
+        first_user += n_users
+        first_interaction += n_inter
+
+    with multiprocessing.get_context("spawn").Pool(workers) as pool:
+        shard_paths = pool.starmap(_gen_shard, jobs)
+    return [path for paths in shard_paths for path in paths]
 
 
 def parse_args():
@@ -139,30 +476,50 @@ def parse_args():
     p.add_argument("--users", type=int, default=20, help="Number of users")
     p.add_argument("--posts-per-user", type=int, default=5, help="Posts per user")
     p.add_argument("--interactions", type=int, default=60, help="Number of interactions (DMs)")
-    p.add_argument("--seed", type=int, default=None, help="Random seed (optional)")
+    p.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed for the run's np.random.Generator; omit for a fresh random run",
+    )
     p.add_argument("--out-dir", type=str, default="data", help="Output directory")
     p.add_argument("--prefix", type=str, default="safescroll", help="Output filename prefix")
+    p.add_argument(
+        "--format",
+        choices=OUTPUT_FORMATS,
+        default="feather",
+        help="Output file format (feather/parquet are zstd-compressed)",
+    )
+    p.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Worker processes; above 1, output is written as one file set per shard",
+    )
     return p.parse_args()
 
 
 def main():
     args = parse_args()
 
-    if args.seed is not None:
-        random.seed(args.seed)
-        pd.np.random.seed(args.seed)  # type: ignore[attr-defined]
-
     data_dir = Path(args.out_dir)
-    users = generate_users(args.users)
-    posts = generate_posts(users, posts_per_user=args.posts_per_user)
-    interactions = generate_interactions(users, n_interactions=args.interactions)
-
-    save_data(data_dir, args.prefix, users, posts, interactions)
+    # Each shard needs at least two users to sample interaction pairs from
+    workers = max(1, min(args.workers, args.users // 2))
+    if workers > 1:
+        paths = generate_shards(args, workers)
+    else:
+        rng = np.random.default_rng(args.seed)
+        paths = write_dataset(
+            rng,
+            args.users,
+            args.posts_per_user,
+            args.interactions,
+            data_dir,
+            args.prefix,
+            args.format,
+        )
 
-    print(
-        f"Synthetic data written to {data_dir}/{args.prefix}_users.csv, "
-        f"{data_dir}/{args.prefix}_posts.csv, {data_dir}/{args.prefix}_interactions.csv"
-    )
+    print(f"Synthetic data written to {', '.join(str(path) for path in paths)}")
 
 
 if __name__ == "__main__":